@@ -14,10 +14,22 @@ __version__ = "1.0.0"
 __author__ = "Theo Zhang"
 __description__ = "用于比较和监控不同数据库之间数据一致性的 Prometheus 导出器"
 
-from .core import TableComparator
-from .db import DatabaseConnectionManager
-from .metrics import MetricsCollector
-from .config import load_config
+# 延迟导入子模块，避免 import dbdiff 时加载数据库驱动、pydantic 等依赖
+_LAZY_IMPORTS = {
+    'TableComparator': '.core',
+    'DatabaseConnectionManager': '.db',
+    'MetricsCollector': '.metrics',
+    'load_config': '.config',
+}
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        import importlib
+        module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 __all__ = [
     'TableComparator',
@@ -14,6 +14,8 @@ class DatabaseConfig(BaseModel):
     pool_size: int = Field(default=5, ge=1, le=100)
     pool_timeout: int = Field(default=30, ge=1)
     connect_timeout: int = Field(default=10, ge=1)
+    retry_interval: int = Field(default=5, ge=1)
+    max_retry_interval: int = Field(default=60, ge=1)
 
 class OracleConfig(DatabaseConfig):
     """Oracle 特定配置。"""
@@ -31,6 +33,7 @@ class TableConfig(BaseModel):
     primary_key: str
     batch_columns: List[str]
     comparison_columns: List[str]
+    exclude_columns: List[str] = Field(default_factory=list)
 
 class MonitoringConfig(BaseModel):
     """监控配置。"""
@@ -62,6 +65,21 @@ class PerformanceConfig(BaseModel):
     connection_pool_size: int = Field(default=5, ge=1)
     query_timeout: int = Field(default=300, ge=1)
 
+class IntrospectionConfig(BaseModel):
+    """表结构内省配置。"""
+    ddl_check_interval: int = Field(default=300, ge=0)
+    exclude_lob_columns: bool = True
+    volatile_columns: List[str] = Field(default_factory=list)
+
+class HistoryConfig(BaseModel):
+    """比较历史存储配置。"""
+    enabled: bool = True
+    path: str = ""  # 为空时保存在配置文件所在目录
+    raw_retention: int = Field(default=86400, ge=1)
+    rollup_interval: int = Field(default=3600, ge=1)
+    rollup_retention: int = Field(default=2592000, ge=1)
+    trend_window: int = Field(default=3600, ge=1)
+
 class AppConfig(BaseModel):
     """主应用配置。"""
     databases: Dict[str, DatabaseConfig]
@@ -70,6 +88,8 @@ class AppConfig(BaseModel):
     metrics: MetricsConfig
     logging: LoggingConfig
     performance: PerformanceConfig
+    introspection: IntrospectionConfig = Field(default_factory=IntrospectionConfig)
+    history: HistoryConfig = Field(default_factory=HistoryConfig)
 
 def load_config(config_path: Optional[str] = None) -> Dict[str, Any]:
     """
@@ -99,5 +119,11 @@ def load_config(config_path: Optional[str] = None) -> Dict[str, Any]:
     # 验证配置
     config = AppConfig(**config_dict)
     
+    # 比较历史默认与配置文件放在同一目录（容器中为可写的 /config）
+    if not config.history.path:
+        config.history.path = os.path.join(
+            os.path.dirname(os.path.abspath(config_path)), 'dbdiff_history.db'
+        )
+    
     # 转换为字典以保持向后兼容性
     return config.model_dump() 
\ No newline at end of file
@@ -2,6 +2,7 @@
 核心比较逻辑模块。
 """
 
-from .comparator import TableComparator
+from .comparator import TableComparator, ComparisonResult
+from .schema import SchemaIntrospector, TablePlan
 
-__all__ = ['TableComparator'] 
\ No newline at end of file
+__all__ = ['TableComparator', 'ComparisonResult', 'SchemaIntrospector', 'TablePlan'] 
\ No newline at end of file
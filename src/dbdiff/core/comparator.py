@@ -2,25 +2,42 @@
 数据库表比较的核心逻辑模块。
 """
 from typing import Dict, Any, List, Tuple, Optional
+from dataclasses import dataclass
 import asyncio
 import logging
 import time
 from ..db.connection import DatabaseConnectionManager
 from ..metrics.collectors import MetricsCollector
+from ..metrics.history import ComparisonHistory
+from .schema import SchemaIntrospector, TablePlan, is_schema_error
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class ComparisonResult:
+    """一次数据比较的结果，摘要为整表的 "行数:校验和"。"""
+    is_consistent: bool
+    oracle_digest: Optional[str] = None
+    pg_digest: Optional[str] = None
+    # 仅分块比较时有值
+    mismatched_chunks: Optional[int] = None
+
 class TableComparator:
     """处理 Oracle 和 PostgreSQL 数据库之间的表比较。"""
     
     def __init__(self, 
                  db_manager: DatabaseConnectionManager,
                  metrics: MetricsCollector,
-                 config: Dict[str, Any]):
+                 config: Dict[str, Any],
+                 history: Optional[ComparisonHistory] = None):
         self.db_manager = db_manager
         self.metrics = metrics
         self.config = config
+        self.history = history
+        # 每个表最近一次计算的趋势指标，供调度使用
+        self.trends: Dict[str, Dict[str, Optional[float]]] = {}
         self.chunk_size = config['performance']['chunk_size']
+        self.schema = SchemaIntrospector(db_manager, config)
     
     async def compare_table(self, table_config: Dict[str, Any]) -> bool:
         """
@@ -29,6 +46,9 @@ class TableComparator:
         """
         table_name = table_config['name']
         start_time = time.time()
+        oracle_count = pg_count = None
+        status = -1
+        result = None
         
         try:
             # 获取行数
@@ -41,16 +61,21 @@ class TableComparator:
             
             # 如果行数不匹配，无需进行详细比较
             if oracle_count != pg_count:
+                status = 0
                 self.metrics.set_comparison_status(table_name, 0)  # 不一致
                 return False
             
             # 对于大表，使用分块比较
             if oracle_count > self.chunk_size:
-                is_consistent = await self._compare_large_table(table_config)
+                result = await self._compare_large_table(table_config, oracle_count)
             else:
-                is_consistent = await self._compare_small_table(table_config)
+                result = await self._compare_small_table(table_config)
+            is_consistent = result.is_consistent
+            if result.mismatched_chunks is not None:
+                self.metrics.set_mismatched_chunks(table_name, result.mismatched_chunks)
             
             # 更新最终指标
+            status = 1 if is_consistent else 0
             self.metrics.set_comparison_status(table_name, 1 if is_consistent else 0)
             if is_consistent:
                 self.metrics.update_last_successful_comparison(table_name, time.time())
@@ -59,6 +84,9 @@ class TableComparator:
             
         except Exception as e:
             logger.error(f"比较表 {table_name} 时出错: {str(e)}")
+            # 错误表明表结构已变化时，下次比较重新解析
+            if is_schema_error(e):
+                self.schema.invalidate(table_name)
             self.metrics.increment_comparison_error(table_name, str(type(e).__name__))
             self.metrics.set_comparison_status(table_name, -1)  # 错误
             return False
@@ -66,6 +94,48 @@ class TableComparator:
         finally:
             duration = time.time() - start_time
             self.metrics.observe_comparison_duration(table_name, duration)
+            if self.history:
+                await self._record_history(
+                    table_name, status, oracle_count, pg_count, duration, result
+                )
+    
+    async def _record_history(self,
+                              table_name: str,
+                              status: int,
+                              oracle_count: Optional[int],
+                              pg_count: Optional[int],
+                              duration: float,
+                              result: Optional[ComparisonResult]):
+        """将比较结果写入历史存储并更新趋势指标。"""
+        result = result or ComparisonResult(False)
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(
+                None, self.history.record_table,
+                table_name, status, oracle_count, pg_count, duration,
+                result.oracle_digest, result.pg_digest, result.mismatched_chunks
+            )
+            trend = await loop.run_in_executor(
+                None, self.history.get_table_trend, table_name
+            )
+            self.trends[table_name] = trend
+            self.metrics.set_table_trend(table_name, trend)
+        except Exception as e:
+            logger.error(f"记录表 {table_name} 的比较历史时出错: {str(e)}")
+    
+    async def load_trends(self, tables: List[Dict[str, Any]]):
+        """从历史存储加载各表的趋势指标，用于重启后的调度。"""
+        loop = asyncio.get_event_loop()
+        for table_config in tables:
+            table_name = table_config['name']
+            try:
+                trend = await loop.run_in_executor(
+                    None, self.history.get_table_trend, table_name
+                )
+                self.trends[table_name] = trend
+                self.metrics.set_table_trend(table_name, trend)
+            except Exception as e:
+                logger.error(f"加载表 {table_name} 的趋势指标时出错: {str(e)}")
     
     async def _get_row_counts(self, table_name: str) -> Tuple[int, int]:
         """获取两个数据库中的行数。"""
@@ -88,16 +158,8 @@ class TableComparator:
         """执行计数查询并跟踪指标。"""
         start_time = time.time()
         try:
-            cursor = await asyncio.get_event_loop().run_in_executor(
-                None, conn.cursor
-            )
-            await asyncio.get_event_loop().run_in_executor(
-                None, cursor.execute, f"SELECT COUNT(*) FROM {table_name}"
-            )
-            result = await asyncio.get_event_loop().run_in_executor(
-                None, cursor.fetchone
-            )
-            return result[0]
+            rows = await self.db_manager.fetch_all(conn, f"SELECT COUNT(*) FROM {table_name}")
+            return rows[0][0]
         except Exception as e:
             self.metrics.increment_query_error(database, table_name, str(type(e).__name__))
             raise
@@ -105,66 +167,196 @@ class TableComparator:
             duration = time.time() - start_time
             self.metrics.observe_query_duration(database, table_name, 'count', duration)
     
-    async def _compare_large_table(self, table_config: Dict[str, Any]) -> bool:
-        """使用批处理列对大表进行分块比较。"""
-        table_name = table_config['name']
-        batch_columns = table_config['batch_columns']
+    async def _execute_query(self,
+                             conn: Any,
+                             sql: str,
+                             params: Any,
+                             table_name: str,
+                             database: str,
+                             query_type: str) -> List[Tuple]:
+        """执行查询并跟踪指标，返回全部结果行。"""
+        start_time = time.time()
+        try:
+            return await self.db_manager.fetch_all(conn, sql, params)
+        except Exception as e:
+            self.metrics.increment_query_error(database, table_name, str(type(e).__name__))
+            raise
+        finally:
+            duration = time.time() - start_time
+            self.metrics.observe_query_duration(database, table_name, query_type, duration)
+    
+    async def _run_on_both(self,
+                           plan: TablePlan,
+                           oracle_sql: str,
+                           pg_sql: str,
+                           oracle_params: Any,
+                           pg_params: Any,
+                           query_type: str) -> Tuple[List[Tuple], List[Tuple]]:
+        """在两个数据库上执行预编译的查询。"""
+        async with self.db_manager.get_oracle_connection() as oracle_conn:
+            oracle_rows = await self._execute_query(
+                oracle_conn, oracle_sql, oracle_params, plan.table_name, 'oracle', query_type
+            )
+        
+        async with self.db_manager.get_pg_connection() as pg_conn:
+            pg_rows = await self._execute_query(
+                pg_conn, pg_sql, pg_params, plan.table_name, 'postgresql', query_type
+            )
+        
+        return oracle_rows, pg_rows
+    
+    async def _compare_large_table(self,
+                                   table_config: Dict[str, Any],
+                                   row_count: int) -> ComparisonResult:
+        """
+        使用批处理列对大表进行分块比较。
+        比较全部分块以统计不一致的分块数；校验和可加，各分块结果累加为整表摘要。
+        """
+        plan = await self.schema.get_plan(table_config)
         
         # 获取分块边界
-        chunks = await self._get_table_chunks(table_name, batch_columns)
+        chunks = await self._get_table_chunks(plan, row_count)
         
         # 比较每个分块
-        for chunk_id, (start_values, end_values) in enumerate(chunks):
-            is_consistent = await self._compare_chunk(
-                table_config, chunk_id, start_values, end_values
+        oracle_total = pg_total = (0, 0)
+        mismatched_chunks = 0
+        for chunk_id, (start_value, end_value) in enumerate(chunks):
+            oracle_row, pg_row = await self._compare_chunk(
+                plan, chunk_id, start_value, end_value
             )
-            if not is_consistent:
-                return False
+            if not self._checksums_match(oracle_row, pg_row):
+                mismatched_chunks += 1
+            oracle_total = self._add_checksums(oracle_total, oracle_row)
+            pg_total = self._add_checksums(pg_total, pg_row)
         
-        return True
+        return ComparisonResult(
+            is_consistent=mismatched_chunks == 0,
+            oracle_digest=self._format_digest(oracle_total),
+            pg_digest=self._format_digest(pg_total),
+            mismatched_chunks=mismatched_chunks
+        )
     
-    async def _compare_small_table(self, table_config: Dict[str, Any]) -> bool:
+    async def _compare_small_table(self, table_config: Dict[str, Any]) -> ComparisonResult:
         """使用校验和或完整比较来比较小表。"""
-        table_name = table_config['name']
-        columns = table_config['comparison_columns']
+        plan = await self.schema.get_plan(table_config)
         
         # 如果启用了校验和比较，则使用校验和
         if self.config['metrics']['collection']['include_checksum']:
-            return await self._compare_checksums(table_name, columns)
+            return await self._compare_checksums(plan)
         
         # 否则进行完整的行比较
-        return await self._compare_all_rows(table_name, columns)
+        return await self._compare_all_rows(plan)
     
-    async def _get_table_chunks(self, 
-                              table_name: str, 
-                              batch_columns: List[str]) -> List[Tuple[Any, Any]]:
-        """获取批处理的分块边界。"""
-        # 根据具体需求和数据分布实现
-        # 这是一个需要根据需求实现的占位符
-        pass
+    async def _get_table_chunks(self,
+                              plan: TablePlan,
+                              row_count: int) -> List[Tuple[Any, Optional[Any]]]:
+        """
+        获取批处理的分块边界。
+        在 Oracle 端按第一个批处理列将表等分为约 chunk_size 行的分块，
+        返回 (起点, 终点) 列表，最后一个分块的终点为 None。
+        批处理列为 NULL 的行只参与行数比较。
+        """
+        tiles = max(1, -(-row_count // self.chunk_size))
+        async with self.db_manager.get_oracle_connection() as oracle_conn:
+            rows = await self._execute_query(
+                oracle_conn, plan.oracle_bounds_sql, [tiles],
+                plan.table_name, 'oracle', 'chunk_bounds'
+            )
+        
+        # 重复值可能跨越多个分块，去重后避免出现空分块
+        starts = sorted({row[0] for row in rows})
+        return list(zip(starts, starts[1:] + [None]))
     
     async def _compare_chunk(self,
-                           table_config: Dict[str, Any],
+                           plan: TablePlan,
                            chunk_id: int,
-                           start_values: Any,
-                           end_values: Any) -> bool:
-        """比较特定数据块之间的数据。"""
-        # 根据具体需求实现
-        # 这是一个需要根据需求实现的占位符
-        pass
-    
-    async def _compare_checksums(self, 
-                               table_name: str, 
-                               columns: List[str]) -> bool:
+                           start_value: Any,
+                           end_value: Optional[Any]) -> Tuple[Tuple, Tuple]:
+        """
+        比较特定数据块之间的数据，返回两侧的 (行数, 校验和)。
+        分块范围按第一个批处理列过滤，左闭右开；终点为 None 时不设上界。
+        """
+        start_time = time.time()
+        if end_value is None:
+            oracle_sql, pg_sql = plan.oracle_tail_checksum_sql, plan.pg_tail_checksum_sql
+            oracle_params, pg_params = [start_value], (start_value,)
+        else:
+            oracle_sql, pg_sql = plan.oracle_chunk_checksum_sql, plan.pg_chunk_checksum_sql
+            oracle_params, pg_params = [start_value, end_value], (start_value, end_value)
+        
+        oracle_rows, pg_rows = await self._run_on_both(
+            plan, oracle_sql, pg_sql, oracle_params, pg_params, 'chunk_checksum'
+        )
+        is_consistent = self._checksums_match(oracle_rows[0], pg_rows[0])
+        if self.history:
+            await self._record_chunk_history(
+                plan.table_name, chunk_id, oracle_rows[0], pg_rows[0],
+                is_consistent, time.time() - start_time
+            )
+        return oracle_rows[0], pg_rows[0]
+    
+    async def _record_chunk_history(self,
+                                    table_name: str,
+                                    chunk_id: int,
+                                    oracle_row: Tuple,
+                                    pg_row: Tuple,
+                                    is_consistent: bool,
+                                    duration: float):
+        """将分块比较结果写入历史存储，写入失败不影响比较结果。"""
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.history.record_chunk,
+                table_name, chunk_id,
+                self._format_digest(oracle_row), self._format_digest(pg_row),
+                is_consistent, duration
+            )
+        except Exception as e:
+            logger.error(f"记录表 {table_name} 分块 {chunk_id} 的比较历史时出错: {str(e)}")
+    
+    async def _compare_checksums(self, plan: TablePlan) -> ComparisonResult:
         """使用校验和比较表。"""
-        # 根据数据库特定的校验和函数实现
-        # 这是一个需要根据需求实现的占位符
-        pass
+        oracle_rows, pg_rows = await self._run_on_both(
+            plan, plan.oracle_checksum_sql, plan.pg_checksum_sql, None, None, 'checksum'
+        )
+        return ComparisonResult(
+            is_consistent=self._checksums_match(oracle_rows[0], pg_rows[0]),
+            oracle_digest=self._format_digest(oracle_rows[0]),
+            pg_digest=self._format_digest(pg_rows[0])
+        )
     
-    async def _compare_all_rows(self, 
-                              table_name: str, 
-                              columns: List[str]) -> bool:
+    async def _compare_all_rows(self, plan: TablePlan) -> ComparisonResult:
         """比较表中的所有行。"""
-        # 根据具体需求实现
-        # 这是一个需要根据需求实现的占位符
-        pass 
\ No newline at end of file
+        oracle_rows, pg_rows = await self._run_on_both(
+            plan, plan.oracle_fetch_sql, plan.pg_fetch_sql, None, None, 'fetch'
+        )
+        oracle_hashes = {key: row_hash.lower() for key, row_hash in oracle_rows}
+        pg_hashes = {key: row_hash.lower() for key, row_hash in pg_rows}
+        return ComparisonResult(
+            is_consistent=oracle_hashes == pg_hashes,
+            oracle_digest=self._hashes_digest(oracle_hashes.values()),
+            pg_digest=self._hashes_digest(pg_hashes.values())
+        )
+    
+    @classmethod
+    def _hashes_digest(cls, hashes: Any) -> str:
+        """按校验和查询的算法（行哈希前 32 位求和）计算摘要。"""
+        hashes = list(hashes)
+        return cls._format_digest((len(hashes), sum(int(h[:8], 16) for h in hashes)))
+    
+    @staticmethod
+    def _add_checksums(total: Tuple, row: Tuple) -> Tuple[int, int]:
+        """累加两个 (行数, 校验和) 结果。"""
+        return int(total[0]) + int(row[0]), int(total[1] or 0) + int(row[1] or 0)
+    
+    @staticmethod
+    def _format_digest(row: Tuple) -> str:
+        """将 (行数, 校验和) 结果格式化为历史记录中的摘要。"""
+        count, checksum = row
+        return f"{int(count)}:{int(checksum or 0)}"
+    
+    @staticmethod
+    def _checksums_match(oracle_row: Tuple, pg_row: Tuple) -> bool:
+        """比较两侧的 (行数, 校验和) 结果。"""
+        oracle_count, oracle_sum = oracle_row
+        pg_count, pg_sum = pg_row
+        return int(oracle_count) == int(pg_count) and int(oracle_sum or 0) == int(pg_sum or 0)
@@ -0,0 +1,526 @@
+"""
+表结构内省与比较查询预编译模块。
+
+从 Oracle 的 ALL_TAB_COLUMNS 和 PostgreSQL 的 information_schema 解析实际的
+比较列及类型，按表缓存，并在检测到 DDL 变化时失效。每个表的规范化哈希表达式
+和查询语句只在解析时生成一次，之后的每个分块直接复用。
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+import time
+from ..db.connection import DatabaseConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# 两侧统一的 NULL 标记和列分隔符（Oracle 中空字符串等同于 NULL）
+NULL_MARKER = "'<NULL>'"
+COLUMN_SEPARATOR = "'|'"
+
+# 未启用 MAX_STRING_SIZE=EXTENDED 时 Oracle VARCHAR2 和 RAW 表达式的最大字节数
+ORACLE_MAX_STRING_SIZE = 4000
+ORACLE_MAX_RAW_SIZE = 2000
+
+# 数据库字符集为这些值时 VARCHAR2 的字节长度即为 UTF-8 字节长度
+ORACLE_UTF8_CHARSETS = {'AL32UTF8', 'UTF8'}
+
+# 各规范化类别文本的最大宽度（字节），文本和二进制类别按列长度计算
+KIND_WIDTHS = {
+    'number': 65,
+    'date': 19,
+    'timestamp': 26,
+    'lob': 20,
+    'boolean': 40,
+}
+
+# Oracle 类型到规范化类别的映射
+ORACLE_TYPE_KINDS = {
+    'NUMBER': 'number',
+    'FLOAT': 'number',
+    'INTEGER': 'number',
+    'BINARY_FLOAT': 'number',
+    'BINARY_DOUBLE': 'number',
+    'DATE': 'date',
+    'CHAR': 'char',
+    'NCHAR': 'char',
+    'VARCHAR2': 'text',
+    'NVARCHAR2': 'text',
+    'RAW': 'binary',
+    'CLOB': 'lob',
+    'NCLOB': 'lob',
+    'BLOB': 'lob',
+    'BFILE': 'lob',
+    'LONG': 'lob',
+    'LONG RAW': 'lob',
+    'XMLTYPE': 'lob',
+}
+
+# PostgreSQL 类型到规范化类别的映射
+PG_TYPE_KINDS = {
+    'smallint': 'number',
+    'integer': 'number',
+    'bigint': 'number',
+    'numeric': 'number',
+    'real': 'number',
+    'double precision': 'number',
+    'date': 'date',
+    'timestamp without time zone': 'timestamp',
+    'timestamp with time zone': 'timestamp',
+    'character': 'char',
+    'character varying': 'text',
+    'text': 'text',
+    'boolean': 'boolean',
+    'bytea': 'binary',
+    'json': 'lob',
+    'jsonb': 'lob',
+    'xml': 'lob',
+}
+
+ORACLE_COLUMNS_SQL = (
+    "SELECT column_name, data_type, data_length, char_length FROM all_tab_columns "
+    "WHERE owner = NVL(:owner, SYS_CONTEXT('USERENV', 'CURRENT_SCHEMA')) "
+    "AND table_name = :name ORDER BY column_id"
+)
+
+ORACLE_CHARSET_SQL = (
+    "SELECT value FROM nls_database_parameters WHERE parameter = 'NLS_CHARACTERSET'"
+)
+
+ORACLE_DDL_SIGNATURE_SQL = (
+    "SELECT TO_CHAR(last_ddl_time, 'YYYYMMDDHH24MISS') FROM all_objects "
+    "WHERE owner = NVL(:owner, SYS_CONTEXT('USERENV', 'CURRENT_SCHEMA')) "
+    "AND object_name = :name AND object_type = 'TABLE'"
+)
+
+# 表结构变化导致的错误：列或表不存在、类型不匹配等
+ORACLE_SCHEMA_ERRORS = ('ORA-00904', 'ORA-00942', 'ORA-00932')
+PG_SCHEMA_ERROR_CODES = {'42703', '42P01', '42804', '42883'}
+
+PG_COLUMNS_SQL = (
+    "SELECT column_name, data_type FROM information_schema.columns "
+    "WHERE table_schema = COALESCE(%s, current_schema()) "
+    "AND table_name = %s ORDER BY ordinal_position"
+)
+
+# PostgreSQL 没有 DDL 时间戳，使用列定义的摘要作为签名
+PG_DDL_SIGNATURE_SQL = (
+    "SELECT md5(string_agg(attname || ':' || atttypid || ':' || atttypmod, ',' "
+    "ORDER BY attnum)) FROM pg_attribute "
+    "WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped"
+)
+
+
+def is_schema_error(error: Exception) -> bool:
+    """判断查询错误是否表明表结构已经变化。"""
+    if getattr(error, 'pgcode', None) in PG_SCHEMA_ERROR_CODES:
+        return True
+    message = str(error)
+    return any(code in message for code in ORACLE_SCHEMA_ERRORS)
+
+
+def _oracle_kind(data_type: str) -> str:
+    """返回 Oracle 数据类型的规范化类别。"""
+    if data_type.startswith('TIMESTAMP'):
+        return 'timestamp'
+    return ORACLE_TYPE_KINDS.get(data_type, 'text')
+
+
+def _pg_kind(data_type: str) -> str:
+    """返回 PostgreSQL 数据类型的规范化类别。"""
+    return PG_TYPE_KINDS.get(data_type, 'text')
+
+
+def _oracle_canonical(column: str, kind: str) -> str:
+    """生成 Oracle 列的规范化文本表达式。"""
+    col = f'"{column}"'
+    if kind == 'number':
+        # TM9 会省略小数的前导零，补齐后与 PostgreSQL 的输出一致
+        expr = (f"REGEXP_REPLACE(TO_CHAR({col}, 'TM9', "
+                f"'NLS_NUMERIC_CHARACTERS=''.,'''), '^(-?)\\.', '\\10.')")
+    elif kind == 'date':
+        expr = f"TO_CHAR({col}, 'YYYY-MM-DD HH24:MI:SS')"
+    elif kind == 'timestamp':
+        expr = f"TO_CHAR({col}, 'YYYY-MM-DD HH24:MI:SS.FF6')"
+    elif kind == 'char':
+        expr = f"RTRIM({col})"
+    elif kind == 'binary':
+        expr = f"RAWTOHEX({col})"
+    elif kind == 'lob':
+        expr = f"TO_CHAR(DBMS_LOB.GETLENGTH({col}))"
+    elif kind == 'boolean':
+        # Oracle 端通常以 NUMBER(1) 存储布尔值
+        expr = f"TO_CHAR({col})"
+    else:
+        expr = col
+    return f"NVL({expr}, {NULL_MARKER})"
+
+
+def _pg_canonical(column: str, kind: str, data_type: str) -> str:
+    """生成 PostgreSQL 列的规范化文本表达式。"""
+    col = f'"{column}"'
+    if kind == 'number':
+        expr = f"trim_scale({col}::numeric)::text"
+    elif kind == 'date':
+        # Oracle DATE 精确到秒
+        expr = f"to_char({col}, 'YYYY-MM-DD HH24:MI:SS')"
+    elif kind == 'timestamp':
+        expr = f"to_char({col}, 'YYYY-MM-DD HH24:MI:SS.US')"
+    elif kind == 'char':
+        expr = f"NULLIF(rtrim({col}), '')"
+    elif kind == 'boolean':
+        # NULL 保持为 NULL，由外层 COALESCE 统一转换为 NULL 标记
+        expr = f"CASE WHEN {col} THEN '1' WHEN NOT {col} THEN '0' END"
+    elif kind == 'binary':
+        expr = f"upper(encode({col}, 'hex'))"
+    elif kind == 'lob' and data_type == 'bytea':
+        expr = f"octet_length({col})::text"
+    elif kind == 'lob':
+        expr = f"length({col}::text)::text"
+    else:
+        expr = f"NULLIF({col}::text, '')"
+    return f"COALESCE({expr}, {NULL_MARKER})"
+
+
+def _canonical_width(column: 'ColumnInfo', utf8_database: bool) -> int:
+    """估算列的规范化文本转换为 AL32UTF8 后的最大字节数（含分隔符）。"""
+    if column.kind in KIND_WIDTHS:
+        width = KIND_WIDTHS[column.kind]
+    elif column.kind == 'binary':
+        width = 2 * column.oracle_length
+    elif column.oracle_type.startswith('N') or not utf8_database:
+        # 国家字符集或非 UTF-8 数据库字符集中的每个字符转换后最多 3 字节
+        width = 3 * (column.oracle_char_length or column.oracle_length)
+    else:
+        width = column.oracle_length
+    return max(width, len(NULL_MARKER) - 2) + 1
+
+
+def _group_columns(columns: List['ColumnInfo'],
+                   table_name: str,
+                   utf8_database: bool) -> List[List['ColumnInfo']]:
+    """
+    按 Oracle RAW 长度上限将列分组，每组转换为 AL32UTF8 后单独计算哈希。
+    单列规范化文本超过上限时报错。
+    """
+    groups: List[List[ColumnInfo]] = []
+    current: List[ColumnInfo] = []
+    current_width = 0
+    for column in columns:
+        width = _canonical_width(column, utf8_database)
+        # 单列独占一组时不需要分隔符
+        if width - 1 > ORACLE_MAX_RAW_SIZE:
+            raise ValueError(
+                f"表 {table_name} 的列 {column.name} 规范化后可能超过 "
+                f"{ORACLE_MAX_RAW_SIZE} 字节，请将其加入 exclude_columns"
+            )
+        if current and current_width + width > ORACLE_MAX_RAW_SIZE:
+            groups.append(current)
+            current, current_width = [], 0
+        current.append(column)
+        current_width += width
+    if current:
+        groups.append(current)
+    # 各组 32 位十六进制摘要拼接后同样受长度上限限制
+    if len(groups) > 1 and 32 * len(groups) > ORACLE_MAX_STRING_SIZE:
+        raise ValueError(f"表 {table_name} 的比较列过多，请通过 exclude_columns 减少比较列")
+    return groups
+
+
+def _oracle_row_hash(groups: List[List['ColumnInfo']]) -> str:
+    """
+    生成 Oracle 端的行哈希表达式（RAW）。
+    各组先转换为 AL32UTF8 字节再计算哈希，与 PostgreSQL 端的 UTF-8 字节一致，
+    不受数据库字符集和 NVARCHAR2 的 AL16UTF16 编码影响。
+    """
+    group_rows = [
+        "UTL_I18N.STRING_TO_RAW(" + f" || {COLUMN_SEPARATOR} || ".join(
+            _oracle_canonical(c.oracle_name, c.kind) for c in group
+        ) + ", 'AL32UTF8')"
+        for group in groups
+    ]
+    if len(group_rows) == 1:
+        return f"STANDARD_HASH({group_rows[0]}, 'MD5')"
+    group_hashes = " || ".join(
+        f"LOWER(RAWTOHEX(STANDARD_HASH({row}, 'MD5')))" for row in group_rows
+    )
+    return f"STANDARD_HASH({group_hashes}, 'MD5')"
+
+
+def _pg_row_hash(groups: List[List['ColumnInfo']]) -> str:
+    """生成 PostgreSQL 端的行哈希表达式（十六进制文本），分组方式与 Oracle 端一致。"""
+    group_rows = [
+        "convert_to(" + f" || {COLUMN_SEPARATOR} || ".join(
+            _pg_canonical(c.pg_name, c.kind, c.pg_type) for c in group
+        ) + ", 'UTF8')"
+        for group in groups
+    ]
+    if len(group_rows) == 1:
+        return f"md5({group_rows[0]})"
+    return "md5(" + " || ".join(f"md5({row})" for row in group_rows) + ")"
+
+
+def _split_table_name(table_name: str) -> Tuple[Optional[str], str]:
+    """将 "schema.table" 拆分为模式名和表名。"""
+    if '.' in table_name:
+        schema, name = table_name.split('.', 1)
+        return schema, name
+    return None, table_name
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    """两侧数据库中同一比较列的元数据。"""
+    name: str
+    oracle_name: str
+    oracle_type: str
+    oracle_length: int
+    oracle_char_length: int
+    pg_name: str
+    pg_type: str
+    kind: str
+
+
+@dataclass
+class TablePlan:
+    """表的已解析列和预编译查询，按表缓存并在各分块间复用。"""
+    table_name: str
+    columns: List[ColumnInfo]
+    excluded_columns: List[str]
+    oracle_checksum_sql: str
+    pg_checksum_sql: str
+    oracle_chunk_checksum_sql: str
+    pg_chunk_checksum_sql: str
+    oracle_tail_checksum_sql: str
+    pg_tail_checksum_sql: str
+    oracle_bounds_sql: str
+    oracle_fetch_sql: str
+    pg_fetch_sql: str
+    oracle_signature: Optional[str] = None
+    pg_signature: Optional[str] = None
+    checked_at: float = field(default_factory=time.time)
+
+
+class SchemaIntrospector:
+    """解析并缓存表结构，生成每个表的比较计划。"""
+
+    def __init__(self,
+                 db_manager: DatabaseConnectionManager,
+                 config: Dict[str, Any]):
+        self.db_manager = db_manager
+        self.config = config
+        introspection = config.get('introspection') or {}
+        self.ddl_check_interval = introspection.get('ddl_check_interval', 300)
+        self.exclude_lob_columns = introspection.get('exclude_lob_columns', True)
+        self.volatile_columns = {
+            c.lower() for c in introspection.get('volatile_columns', [])
+        }
+        self._plans: Dict[str, TablePlan] = {}
+        self._utf8_database: Optional[bool] = None
+
+    async def get_plan(self, table_config: Dict[str, Any]) -> TablePlan:
+        """
+        返回表的比较计划。
+        缓存的计划在检查间隔内直接复用；超过间隔后比对 DDL 签名，
+        签名变化时重新解析表结构。
+        """
+        table_name = table_config['name']
+        plan = self._plans.get(table_name)
+
+        if plan is not None:
+            if time.time() - plan.checked_at < self.ddl_check_interval:
+                return plan
+            oracle_sig, pg_sig = await self._get_ddl_signatures(table_name)
+            if (oracle_sig, pg_sig) == (plan.oracle_signature, plan.pg_signature):
+                plan.checked_at = time.time()
+                return plan
+            logger.info(f"检测到表 {table_name} 的结构变化，重新解析比较列")
+
+        plan = await self._build_plan(table_config)
+        self._plans[table_name] = plan
+        return plan
+
+    def invalidate(self, table_name: Optional[str] = None):
+        """使指定表（或全部表）的缓存计划失效。"""
+        if table_name is None:
+            self._plans.clear()
+        else:
+            self._plans.pop(table_name, None)
+
+    async def _build_plan(self, table_config: Dict[str, Any]) -> TablePlan:
+        """读取两侧的列定义并生成比较计划。"""
+        table_name = table_config['name']
+        oracle_sig, pg_sig = await self._get_ddl_signatures(table_name)
+        oracle_columns, pg_columns = await self._get_columns(table_name)
+        columns, excluded = self._resolve_columns(
+            table_config, oracle_columns, pg_columns
+        )
+
+        key_name = table_config['primary_key'].lower()
+        key = self._make_column(key_name, oracle_columns, pg_columns)
+        if key is None:
+            raise ValueError(f"表 {table_name} 中找不到主键列 {table_config['primary_key']}")
+
+        batch_name = table_config['batch_columns'][0].lower()
+        batch = self._make_column(batch_name, oracle_columns, pg_columns)
+        if batch is None:
+            raise ValueError(f"表 {table_name} 中找不到分批列 {table_config['batch_columns'][0]}")
+
+        groups = _group_columns(columns, table_name, await self._is_utf8_database())
+        oracle_hash = _oracle_row_hash(groups)
+        pg_hash = _pg_row_hash(groups)
+
+        # 取行哈希的前 32 位求和作为与顺序无关的表校验和
+        oracle_checksum = (
+            f"SELECT COUNT(*), SUM(TO_NUMBER(SUBSTR(RAWTOHEX({oracle_hash}), 1, 8), "
+            f"'XXXXXXXX')) FROM {table_name}"
+        )
+        pg_checksum = (
+            f"SELECT COUNT(*), SUM(('x' || substr({pg_hash}, 1, 8))::bit(32)::bigint) "
+            f"FROM {table_name}"
+        )
+        oracle_batch = f'"{batch.oracle_name}"'
+        pg_batch = f'"{batch.pg_name}"'
+
+        plan = TablePlan(
+            table_name=table_name,
+            columns=columns,
+            excluded_columns=excluded,
+            oracle_checksum_sql=oracle_checksum,
+            pg_checksum_sql=pg_checksum,
+            oracle_chunk_checksum_sql=(
+                f"{oracle_checksum} WHERE {oracle_batch} >= :1 AND {oracle_batch} < :2"
+            ),
+            pg_chunk_checksum_sql=(
+                f"{pg_checksum} WHERE {pg_batch} >= %s AND {pg_batch} < %s"
+            ),
+            oracle_tail_checksum_sql=f"{oracle_checksum} WHERE {oracle_batch} >= :1",
+            pg_tail_checksum_sql=f"{pg_checksum} WHERE {pg_batch} >= %s",
+            # 按分批列等分为 :1 块，取每块的最小值作为分块起点
+            oracle_bounds_sql=(
+                f"SELECT MIN({oracle_batch}) FROM ("
+                f"SELECT {oracle_batch}, NTILE(:1) OVER (ORDER BY {oracle_batch}) AS tile "
+                f"FROM {table_name} WHERE {oracle_batch} IS NOT NULL"
+                f") GROUP BY tile ORDER BY 1"
+            ),
+            oracle_fetch_sql=(
+                f"SELECT {_oracle_canonical(key.oracle_name, key.kind)}, "
+                f"LOWER(RAWTOHEX({oracle_hash})) FROM {table_name}"
+            ),
+            pg_fetch_sql=(
+                f"SELECT {_pg_canonical(key.pg_name, key.kind, key.pg_type)}, "
+                f"{pg_hash} FROM {table_name}"
+            ),
+            oracle_signature=oracle_sig,
+            pg_signature=pg_sig,
+        )
+        logger.info(
+            f"表 {table_name} 解析完成: 比较 {len(columns)} 列, "
+            f"排除 {len(excluded)} 列 {excluded}"
+        )
+        return plan
+
+    def _resolve_columns(self,
+                         table_config: Dict[str, Any],
+                         oracle_columns: Dict[str, Tuple[str, str, int, int]],
+                         pg_columns: Dict[str, Tuple[str, str]]
+                         ) -> Tuple[List[ColumnInfo], List[str]]:
+        """确定参与比较的列，排除 LOB 列和易变列。"""
+        requested = table_config['comparison_columns']
+        if '*' in requested:
+            names = list(oracle_columns)
+        else:
+            names = [c.lower() for c in requested]
+
+        excluded_names = self.volatile_columns | {
+            c.lower() for c in table_config.get('exclude_columns', [])
+        }
+
+        columns = []
+        excluded = []
+        for name in names:
+            column = self._make_column(name, oracle_columns, pg_columns)
+            if column is None:
+                logger.warning(
+                    f"表 {table_config['name']} 的列 {name} 未同时存在于两个数据库中，已跳过"
+                )
+                excluded.append(name)
+            elif name in excluded_names:
+                excluded.append(name)
+            elif column.kind == 'lob' and self.exclude_lob_columns:
+                excluded.append(name)
+            else:
+                columns.append(column)
+
+        if not columns:
+            raise ValueError(f"表 {table_config['name']} 没有可比较的列")
+        return columns, excluded
+
+    @staticmethod
+    def _make_column(name: str,
+                     oracle_columns: Dict[str, Tuple[str, str, int, int]],
+                     pg_columns: Dict[str, Tuple[str, str]]) -> Optional[ColumnInfo]:
+        """合并两侧的列定义；任一侧缺失时返回 None。"""
+        if name not in oracle_columns or name not in pg_columns:
+            return None
+        oracle_name, oracle_type, oracle_length, oracle_char_length = oracle_columns[name]
+        pg_name, pg_type = pg_columns[name]
+        oracle_kind = _oracle_kind(oracle_type)
+        pg_kind = _pg_kind(pg_type)
+        # 任一侧为 LOB 时按 LOB 处理，否则以源端 Oracle 类型为准
+        kind = 'lob' if 'lob' in (oracle_kind, pg_kind) else oracle_kind
+        if pg_kind == 'boolean':
+            kind = 'boolean'
+        return ColumnInfo(
+            name=name,
+            oracle_name=oracle_name,
+            oracle_type=oracle_type,
+            oracle_length=int(oracle_length or 0),
+            oracle_char_length=int(oracle_char_length or 0),
+            pg_name=pg_name,
+            pg_type=pg_type,
+            kind=kind,
+        )
+
+    async def _get_columns(self, table_name: str
+                           ) -> Tuple[Dict[str, Tuple[str, str, int, int]], Dict[str, Tuple[str, str]]]:
+        """读取两侧的列定义，以小写列名为键。"""
+        schema, name = _split_table_name(table_name)
+        async with self.db_manager.get_oracle_connection() as oracle_conn:
+            oracle_rows = await self.db_manager.fetch_all(
+                oracle_conn, ORACLE_COLUMNS_SQL,
+                {'owner': schema.upper() if schema else None, 'name': name.upper()}
+            )
+        async with self.db_manager.get_pg_connection() as pg_conn:
+            pg_rows = await self.db_manager.fetch_all(
+                pg_conn, PG_COLUMNS_SQL,
+                (schema.lower() if schema else None, name.lower())
+            )
+        if not oracle_rows or not pg_rows:
+            raise ValueError(f"无法读取表 {table_name} 的列定义")
+        return (
+            {column.lower(): (column, data_type, length, char_length)
+             for column, data_type, length, char_length in oracle_rows},
+            {column.lower(): (column, data_type) for column, data_type in pg_rows},
+        )
+
+    async def _is_utf8_database(self) -> bool:
+        """查询并缓存 Oracle 数据库字符集是否为 UTF-8。"""
+        if self._utf8_database is None:
+            async with self.db_manager.get_oracle_connection() as oracle_conn:
+                rows = await self.db_manager.fetch_all(oracle_conn, ORACLE_CHARSET_SQL)
+            self._utf8_database = bool(rows) and rows[0][0] in ORACLE_UTF8_CHARSETS
+        return self._utf8_database
+
+    async def _get_ddl_signatures(self, table_name: str) -> Tuple[Optional[str], Optional[str]]:
+        """获取两侧表结构的 DDL 签名。"""
+        schema, name = _split_table_name(table_name)
+        async with self.db_manager.get_oracle_connection() as oracle_conn:
+            oracle_rows = await self.db_manager.fetch_all(
+                oracle_conn, ORACLE_DDL_SIGNATURE_SQL,
+                {'owner': schema.upper() if schema else None, 'name': name.upper()}
+            )
+        async with self.db_manager.get_pg_connection() as pg_conn:
+            pg_rows = await self.db_manager.fetch_all(pg_conn, PG_DDL_SIGNATURE_SQL, (table_name.lower(),))
+        oracle_sig = oracle_rows[0][0] if oracle_rows else None
+        pg_sig = pg_rows[0][0] if pg_rows else None
+        return oracle_sig, pg_sig
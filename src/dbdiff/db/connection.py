@@ -1,63 +1,209 @@
 """
 数据库连接管理模块。
 """
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import asyncio
 import logging
-import oracledb
-import psycopg2
-from psycopg2.pool import ThreadedConnectionPool
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 logger = logging.getLogger(__name__)
 
 class DatabaseConnectionManager:
-    """管理数据库连接和连接池。"""
+    """
+    管理数据库连接和连接池。
+    数据库驱动在首次创建连接池时才导入；连接池由 start() 在后台创建，
+    失败时按退避间隔重试，单个数据库不可用不会阻塞应用启动。
+    """
     
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self._oracle_pool = None
         self._pg_pool = None
-        self.setup_connection_pools()
+        self._setup_tasks: Dict[str, asyncio.Task] = {}
+        # 就绪检查使用独立的执行器，数据库挂起时不会占满比较查询使用的默认执行器
+        self._ping_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dbdiff-ping')
+        self._ping_futures: Dict[str, asyncio.Future] = {}
     
-    def setup_connection_pools(self):
-        """初始化数据库连接池。"""
-        try:
-            # 设置 Oracle 连接池
-            oracle_config = self.config['databases']['oracle']
-            self._oracle_pool = oracledb.SessionPool(
-                user=oracle_config['user'],
-                password=oracle_config['password'],
-                dsn=oracle_config['dsn'],
-                min=1,
-                max=oracle_config['pool_size'],
-                increment=1,
-                getmode=oracledb.SPOOL_ATTRVAL_WAIT,
-                timeout=oracle_config['pool_timeout']
-            )
-            logger.info("Oracle 连接池初始化完成")
-            
-            # 设置 PostgreSQL 连接池
-            pg_config = self.config['databases']['postgresql']
-            self._pg_pool = ThreadedConnectionPool(
-                minconn=1,
-                maxconn=pg_config['pool_size'],
-                host=pg_config['host'],
-                port=pg_config['port'],
-                database=pg_config['database'],
-                user=pg_config['user'],
-                password=pg_config['password'],
-                connect_timeout=pg_config['connect_timeout']
-            )
-            logger.info("PostgreSQL 连接池初始化完成")
+    def start(self):
+        """在后台启动连接池的创建，立即返回。"""
+        for db_name, create in (('oracle', self._create_oracle_pool),
+                                ('postgresql', self._create_pg_pool)):
+            if db_name not in self._setup_tasks:
+                self._setup_tasks[db_name] = asyncio.create_task(
+                    self._setup_with_retry(db_name, create)
+                )
+    
+    async def _setup_with_retry(self, db_name: str, create):
+        """创建连接池，失败时按指数退避重试直到成功。"""
+        db_config = self.config['databases'][db_name]
+        delay = db_config.get('retry_interval', 5)
+        max_delay = db_config.get('max_retry_interval', 60)
+        while True:
+            future = asyncio.get_event_loop().run_in_executor(None, create)
+            try:
+                pool = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 执行器线程中的创建无法中断，完成后关闭被丢弃的连接池
+                future.add_done_callback(self._close_abandoned_pool)
+                raise
+            except Exception as e:
+                logger.error(f"初始化 {db_name} 连接池时出错: {str(e)}，{delay} 秒后重试")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+                continue
             
+            if db_name == 'oracle':
+                self._oracle_pool = pool
+            else:
+                self._pg_pool = pool
+            logger.info(f"{db_name} 连接池初始化完成")
+            return
+    
+    @staticmethod
+    def _close_pool(pool: Any):
+        """关闭 Oracle 或 PostgreSQL 连接池。"""
+        if hasattr(pool, 'closeall'):
+            pool.closeall()
+        else:
+            pool.close(force=True)
+    
+    @classmethod
+    def _close_abandoned_pool(cls, future: asyncio.Future):
+        """关闭创建完成时已被取消的连接池。"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        try:
+            cls._close_pool(future.result())
+        except Exception as e:
+            logger.error(f"关闭被丢弃的连接池时出错: {str(e)}")
+    
+    def _create_oracle_pool(self):
+        """创建 Oracle 连接池。"""
+        import oracledb
+        
+        oracle_config = self.config['databases']['oracle']
+        pool = oracledb.SessionPool(
+            user=oracle_config['user'],
+            password=oracle_config['password'],
+            dsn=oracle_config['dsn'],
+            min=1,
+            max=oracle_config['pool_size'],
+            increment=1,
+            # 连接全部占用时最多等待 pool_timeout 秒，避免无限期阻塞执行器线程
+            getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+            wait_timeout=oracle_config['pool_timeout'] * 1000,
+            timeout=oracle_config['pool_timeout']
+        )
+        # thin 模式下数据库不可达时连接池也能创建成功，需实际取出连接验证
+        try:
+            self._ping_oracle_pool(pool)
+        except Exception:
+            pool.close(force=True)
+            raise
+        return pool
+    
+    def _create_pg_pool(self):
+        """创建 PostgreSQL 连接池。"""
+        from psycopg2.pool import ThreadedConnectionPool
+        
+        pg_config = self.config['databases']['postgresql']
+        pool = ThreadedConnectionPool(
+            minconn=1,
+            maxconn=pg_config['pool_size'],
+            host=pg_config['host'],
+            port=pg_config['port'],
+            database=pg_config['database'],
+            user=pg_config['user'],
+            password=pg_config['password'],
+            connect_timeout=pg_config['connect_timeout']
+        )
+        try:
+            self._ping_pg_pool(pool)
+        except Exception:
+            pool.closeall()
+            raise
+        return pool
+    
+    @staticmethod
+    def _ping_oracle_pool(pool: Any):
+        """从 Oracle 连接池取出一个连接并 ping，连接已全部占用时视为可用。"""
+        if pool.busy >= pool.max:
+            return
+        connection = pool.acquire()
+        try:
+            connection.ping()
+        finally:
+            pool.release(connection)
+    
+    @classmethod
+    def _ping_pg_pool(cls, pool: Any):
+        """从 PostgreSQL 连接池取出一个连接并执行 SELECT 1，连接已全部占用时视为可用。"""
+        if len(pool._used) >= pool.maxconn:
+            return
+        try:
+            connection = pool.getconn()
         except Exception as e:
-            logger.error(f"初始化连接池时出错: {str(e)}")
+            # 检查后连接被比较任务取走，连接池已满同样视为可用
+            if type(e).__name__ == 'PoolError':
+                return
             raise
+        try:
+            cls._run_query(connection, "SELECT 1", None)
+        finally:
+            pool.putconn(connection)
+    
+    def get_readiness(self) -> Dict[str, bool]:
+        """获取各数据库连接池是否已就绪。"""
+        return {
+            'oracle': self._oracle_pool is not None,
+            'postgresql': self._pg_pool is not None
+        }
+    
+    async def check_readiness(self) -> Dict[str, bool]:
+        """检查各数据库是否可用：连接池已创建，且能在 connect_timeout 内完成 ping。"""
+        readiness = {}
+        for db_name, pool, ping in (('oracle', self._oracle_pool, self._ping_oracle_pool),
+                                    ('postgresql', self._pg_pool, self._ping_pg_pool)):
+            if pool is None:
+                readiness[db_name] = False
+                continue
+            previous = self._ping_futures.get(db_name)
+            if previous is not None and not previous.done():
+                # 上一次 ping 仍未返回，数据库很可能已挂起，不再占用新的线程
+                logger.warning(f"{db_name} 上一次就绪检查仍未完成")
+                readiness[db_name] = False
+                continue
+            
+            future = asyncio.get_event_loop().run_in_executor(self._ping_executor, ping, pool)
+            future.add_done_callback(self._discard_ping_result)
+            self._ping_futures[db_name] = future
+            timeout = self.config['databases'][db_name]['connect_timeout']
+            try:
+                # shield 使超时后 future 保持未完成，直到线程真正返回并归还连接
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+                readiness[db_name] = True
+            except Exception as e:
+                logger.warning(f"{db_name} 就绪检查失败: {str(e) or type(e).__name__}")
+                readiness[db_name] = False
+        return readiness
+    
+    @staticmethod
+    def _discard_ping_result(future: asyncio.Future):
+        """取出超时后才完成的 ping 的异常，避免未处理异常告警。"""
+        if not future.cancelled():
+            future.exception()
+    
+    @property
+    def is_ready(self) -> bool:
+        """两个数据库的连接池是否都已就绪。"""
+        return all(self.get_readiness().values())
     
     @asynccontextmanager
     async def get_oracle_connection(self):
         """从 Oracle 连接池获取连接。"""
+        if self._oracle_pool is None:
+            raise ConnectionError("Oracle 连接池尚未就绪")
         connection = None
         try:
             connection = await asyncio.get_event_loop().run_in_executor(
@@ -73,6 +219,8 @@ class DatabaseConnectionManager:
     @asynccontextmanager
     async def get_pg_connection(self):
         """从 PostgreSQL 连接池获取连接。"""
+        if self._pg_pool is None:
+            raise ConnectionError("PostgreSQL 连接池尚未就绪")
         connection = None
         try:
             connection = await asyncio.get_event_loop().run_in_executor(
@@ -85,6 +233,22 @@ class DatabaseConnectionManager:
                     None, self._pg_pool.putconn, connection
                 )
     
+    @staticmethod
+    def _run_query(connection: Any, sql: str, params: Any) -> List[Tuple]:
+        """执行查询并返回全部结果，始终关闭游标。"""
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+    
+    async def fetch_all(self, connection: Any, sql: str, params: Any = None) -> List[Tuple]:
+        """在执行器中运行查询并返回全部结果行。"""
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self._run_query, connection, sql, params
+        )
+    
     def get_pool_usage(self) -> Dict[str, int]:
         """获取当前连接池使用统计。"""
         return {
@@ -94,6 +258,16 @@ class DatabaseConnectionManager:
     
     async def close_pools(self):
         """关闭所有连接池。"""
+        for task in self._setup_tasks.values():
+            task.cancel()
+        for task in self._setup_tasks.values():
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._setup_tasks.clear()
+        self._ping_executor.shutdown(wait=False)
+        
         if self._oracle_pool:
             await asyncio.get_event_loop().run_in_executor(
                 None, self._oracle_pool.close
@@ -2,17 +2,19 @@
 数据库差异对比导出器的主应用入口。
 用于比较和监控不同数据库之间数据一致性。
 """
-from fastapi import FastAPI, BackgroundTasks, Response
+from fastapi import FastAPI, BackgroundTasks, Response, HTTPException
+from fastapi.responses import JSONResponse
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import logging
 import yaml
 from contextlib import asynccontextmanager
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 from .config import load_config
 from .db.connection import DatabaseConnectionManager
 from .metrics.collectors import MetricsCollector
+from .metrics.history import ComparisonHistory
 from .core.comparator import TableComparator
 
 # 配置日志
@@ -30,12 +32,13 @@ logger = logging.getLogger(__name__)
 config: Dict[str, Any] = {}
 db_manager: DatabaseConnectionManager = None
 metrics_collector: MetricsCollector = None
+history: ComparisonHistory = None
 table_comparator: TableComparator = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """管理应用生命周期。"""
-    global config, db_manager, metrics_collector, table_comparator
+    global config, db_manager, metrics_collector, history, table_comparator
     
     try:
         # 加载配置
@@ -46,17 +49,40 @@ async def lifespan(app: FastAPI):
             default_labels=config['metrics'].get('labels', {})
         )
         db_manager = DatabaseConnectionManager(config)
-        table_comparator = TableComparator(db_manager, metrics_collector, config)
+        # 连接池在后台创建并自动重试，不阻塞启动
+        db_manager.start()
+        history_config = config['history']
+        if history_config['enabled']:
+            try:
+                history = ComparisonHistory(
+                    path=history_config['path'],
+                    raw_retention=history_config['raw_retention'],
+                    rollup_interval=history_config['rollup_interval'],
+                    rollup_retention=history_config['rollup_retention'],
+                    trend_window=history_config['trend_window']
+                )
+            except Exception as e:
+                # 历史存储不可用时仅禁用该功能，不影响应用启动
+                logger.error(f"打开比较历史 {history_config['path']} 时出错，已禁用比较历史: {str(e)}")
+                history = None
+        table_comparator = TableComparator(db_manager, metrics_collector, config, history)
+        
+        background_tasks = []
+        if history:
+            # 从历史恢复趋势，重启后首轮比较即可按预计耗时排序
+            await table_comparator.load_trends(config['tables'])
+            # 汇总独立于自动刷新运行，手动触发的比较同样会被汇总
+            background_tasks.append(asyncio.create_task(compact_history()))
         
         # 如果启用了自动刷新，启动后台指标收集任务
         if config['monitoring']['auto_refresh']['enabled']:
-            background_task = asyncio.create_task(update_metrics())
+            background_tasks.append(asyncio.create_task(update_metrics()))
         
         logger.info("应用启动成功")
         yield
         
         # 清理资源
-        if config['monitoring']['auto_refresh']['enabled']:
+        for background_task in background_tasks:
             background_task.cancel()
             try:
                 await background_task
@@ -64,6 +90,8 @@ async def lifespan(app: FastAPI):
                 pass
         
         await db_manager.close_pools()
+        if history:
+            history.close()
         logger.info("应用关闭完成")
         
     except Exception as e:
@@ -73,14 +101,19 @@ async def lifespan(app: FastAPI):
 async def update_metrics():
     """后台任务：定期更新指标。"""
     while True:
+        if not db_manager.is_ready:
+            logger.info("数据库连接池尚未就绪，跳过本次比较")
+            await asyncio.sleep(config['monitoring']['auto_refresh']['interval'])
+            continue
+        
         try:
             # 更新连接池指标
             pool_usage = db_manager.get_pool_usage()
             for db_name, usage in pool_usage.items():
                 metrics_collector.set_connection_pool_usage(db_name, usage)
             
-            # 比较所有配置的表
-            for table_config in config['tables']:
+            # 比较所有配置的表，按预计耗时从短到长排序
+            for table_config in plan_tables(config['tables']):
                 await table_comparator.compare_table(table_config)
                 
         except Exception as e:
@@ -89,6 +122,27 @@ async def update_metrics():
         # 等待下一次更新间隔
         await asyncio.sleep(config['monitoring']['auto_refresh']['interval'])
 
+async def compact_history():
+    """后台任务：定期汇总过期的比较历史。"""
+    while True:
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, history.compact)
+        except Exception as e:
+            logger.error(f"汇总比较历史时出错: {str(e)}")
+        
+        await asyncio.sleep(config['history']['rollup_interval'])
+
+def plan_tables(tables: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    根据比较历史预测的耗时安排表的比较顺序，耗时短的表优先，
+    使其指标尽快刷新。没有历史数据的表排在最前面。
+    """
+    def predicted_duration(table_config: Dict[str, Any]) -> float:
+        trend = table_comparator.trends.get(table_config['name'], {})
+        return trend.get('predicted_duration') or 0.0
+    
+    return sorted(tables, key=predicted_duration)
+
 # 创建 FastAPI 应用
 app = FastAPI(
     title="数据库差异对比导出器",
@@ -108,6 +162,8 @@ async def metrics() -> Response:
 @app.post("/check")
 async def check(background_tasks: BackgroundTasks) -> Dict[str, str]:
     """触发手动比较的接口。"""
+    if db_manager is None or not db_manager.is_ready:
+        raise HTTPException(status_code=503, detail="数据库连接池尚未就绪")
     for table_config in config['tables']:
         background_tasks.add_task(
             table_comparator.compare_table,
@@ -120,6 +176,16 @@ async def health() -> Dict[str, str]:
     """健康检查接口。"""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    """就绪检查接口，所有数据库连接池已创建且 ping 成功时返回 200，否则返回 503。"""
+    databases = await db_manager.check_readiness() if db_manager else {}
+    is_ready = bool(databases) and all(databases.values())
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"status": "ready" if is_ready else "not_ready", "databases": databases}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
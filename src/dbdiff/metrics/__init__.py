@@ -3,5 +3,6 @@
 """
 
 from .collectors import MetricsCollector
+from .history import ComparisonHistory
 
-__all__ = ['MetricsCollector'] 
\ No newline at end of file
+__all__ = ['MetricsCollector', 'ComparisonHistory'] 
\ No newline at end of file
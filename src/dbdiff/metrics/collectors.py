@@ -1,7 +1,7 @@
 """
 Prometheus 指标收集器模块。
 """
-from typing import Dict
+from typing import Dict, Optional
 from prometheus_client import Gauge, Counter, Histogram
 
 class MetricsCollector:
@@ -64,12 +64,37 @@ class MetricsCollector:
             ['table', 'chunk_id', 'environment'] + list(self.default_labels.keys())
         )
         
+        self.mismatched_chunks = Gauge(
+            'db_table_mismatched_chunks',
+            '最近一次分块比较中不一致的分块数',
+            ['table', 'environment'] + list(self.default_labels.keys())
+        )
+        
         self.last_successful_comparison = Gauge(
             'db_table_last_successful_comparison',
             '最后一次成功比较的时间戳',
             ['table', 'environment'] + list(self.default_labels.keys())
         )
         
+        # 趋势指标（由比较历史计算）
+        self.table_change_rate = Gauge(
+            'db_table_change_rate_rows_per_second',
+            '源表行数的变化率',
+            ['table', 'environment'] + list(self.default_labels.keys())
+        )
+        
+        self.replication_lag_estimate = Gauge(
+            'db_table_replication_lag_estimate_seconds',
+            '按行数差和变化率估算的复制延迟',
+            ['table', 'environment'] + list(self.default_labels.keys())
+        )
+        
+        self.predicted_comparison_duration = Gauge(
+            'db_table_predicted_comparison_duration_seconds',
+            '预计的下一轮表比较耗时',
+            ['table', 'environment'] + list(self.default_labels.keys())
+        )
+        
         # 资源使用指标
         self.connection_pool_usage = Gauge(
             'db_connection_pool_usage',
@@ -142,6 +167,11 @@ class MetricsCollector:
         }
         self.checksum_status.labels(**labels).set(status)
     
+    def set_mismatched_chunks(self, table: str, count: int, environment: str = 'production'):
+        """设置最近一次分块比较中不一致的分块数。"""
+        labels = {**self.default_labels, 'table': table, 'environment': environment}
+        self.mismatched_chunks.labels(**labels).set(count)
+    
     def update_last_successful_comparison(self, table: str, timestamp: float, 
                                         environment: str = 'production'):
         """更新最后一次成功比较的时间戳。"""
@@ -156,4 +186,14 @@ class MetricsCollector:
     def set_worker_pool_usage(self, usage: int, environment: str = 'production'):
         """设置当前工作线程池使用情况。"""
         labels = {**self.default_labels, 'environment': environment}
-        self.worker_pool_usage.labels(**labels).set(usage) 
\ No newline at end of file
+        self.worker_pool_usage.labels(**labels).set(usage) 
+    
+    def set_table_trend(self, table: str, trend: Dict[str, Optional[float]],
+                        environment: str = 'production'):
+        """设置表的趋势指标，忽略无法计算的值。"""
+        labels = {**self.default_labels, 'table': table, 'environment': environment}
+        for gauge, key in ((self.table_change_rate, 'change_rate'),
+                           (self.replication_lag_estimate, 'replication_lag'),
+                           (self.predicted_comparison_duration, 'predicted_duration')):
+            if trend.get(key) is not None:
+                gauge.labels(**labels).set(trend[key])
\ No newline at end of file
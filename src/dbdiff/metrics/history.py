@@ -0,0 +1,323 @@
+"""
+比较历史存储模块。
+
+使用内嵌的 SQLite 文件保存每次表比较和分块比较的结果。超过原始数据保留期的
+记录按时间桶汇总后删除，汇总数据在汇总保留期后删除。基于历史数据计算变化率、
+复制延迟估计和下一轮比较的预计耗时，避免在 Prometheus 中保存高基数的分块序列。
+"""
+from typing import Dict, List, Optional, Tuple
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS table_results (
+    ts REAL NOT NULL,
+    table_name TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    oracle_count INTEGER,
+    pg_count INTEGER,
+    duration REAL NOT NULL,
+    oracle_digest TEXT,
+    pg_digest TEXT,
+    mismatched_chunks INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_table_results ON table_results (table_name, ts);
+
+CREATE TABLE IF NOT EXISTS chunk_results (
+    ts REAL NOT NULL,
+    table_name TEXT NOT NULL,
+    chunk_id INTEGER NOT NULL,
+    oracle_digest TEXT,
+    pg_digest TEXT,
+    matched INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunk_results ON chunk_results (table_name, ts);
+
+CREATE TABLE IF NOT EXISTS table_rollups (
+    bucket REAL NOT NULL,
+    table_name TEXT NOT NULL,
+    comparisons INTEGER NOT NULL DEFAULT 0,
+    mismatches INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    total_duration REAL NOT NULL DEFAULT 0,
+    max_duration REAL NOT NULL DEFAULT 0,
+    timed_comparisons INTEGER NOT NULL DEFAULT 0,
+    timed_duration REAL NOT NULL DEFAULT 0,
+    last_ts REAL,
+    last_oracle_count INTEGER,
+    last_pg_count INTEGER,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    chunk_mismatches INTEGER NOT NULL DEFAULT 0,
+    chunk_duration REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, bucket)
+);
+"""
+
+# 存储结构版本，保存在 SQLite 的 user_version 中
+_SCHEMA_VERSION = 2
+
+# 旧版本文件中缺少的列，打开时追加。ALTER TABLE 只能把列追加到末尾，
+# 因此所有写入都显式指定列名。
+_ADDED_COLUMNS = {
+    'table_results': [
+        ('oracle_digest', 'TEXT'),
+        ('pg_digest', 'TEXT'),
+        ('mismatched_chunks', 'INTEGER'),
+    ],
+    'table_rollups': [
+        ('timed_comparisons', 'INTEGER NOT NULL DEFAULT 0'),
+        ('timed_duration', 'REAL NOT NULL DEFAULT 0'),
+    ],
+}
+
+# 完整执行的比较：排除出错和因行数不一致提前返回的记录，其耗时用于预测
+_FULL_COMPARISON = "(status = 1 OR (status = 0 AND oracle_count = pg_count))"
+
+# 原始记录不足时用于预测耗时的最近汇总时间桶数
+_PREDICTION_BUCKETS = 24
+
+
+class ComparisonHistory:
+    """表和分块比较结果的内嵌时间序列存储。"""
+
+    def __init__(self,
+                 path: str = 'dbdiff_history.db',
+                 raw_retention: int = 86400,
+                 rollup_interval: int = 3600,
+                 rollup_retention: int = 2592000,
+                 trend_window: int = 3600):
+        self.raw_retention = raw_retention
+        self.rollup_interval = rollup_interval
+        self.rollup_retention = rollup_retention
+        self.trend_window = trend_window
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        """为旧版本创建的存储文件补齐缺少的列。"""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= _SCHEMA_VERSION:
+            return
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for name, definition in columns:
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        logger.info(f"比较历史存储结构已升级到版本 {_SCHEMA_VERSION}")
+
+    def record_table(self,
+                     table: str,
+                     status: int,
+                     oracle_count: Optional[int],
+                     pg_count: Optional[int],
+                     duration: float,
+                     oracle_digest: Optional[str] = None,
+                     pg_digest: Optional[str] = None,
+                     mismatched_chunks: Optional[int] = None,
+                     timestamp: Optional[float] = None):
+        """
+        记录一次表比较结果。
+        摘要为整表的 "行数:校验和"，分块比较时 mismatched_chunks 为不一致的分块数。
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO table_results "
+                "(ts, table_name, status, oracle_count, pg_count, duration, "
+                "oracle_digest, pg_digest, mismatched_chunks) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (timestamp or time.time(), table, status, oracle_count, pg_count, duration,
+                 oracle_digest, pg_digest, mismatched_chunks)
+            )
+
+    def record_chunk(self,
+                     table: str,
+                     chunk_id: int,
+                     oracle_digest: Optional[str],
+                     pg_digest: Optional[str],
+                     matched: bool,
+                     duration: float,
+                     timestamp: Optional[float] = None):
+        """记录一次分块比较结果。"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO chunk_results "
+                "(ts, table_name, chunk_id, oracle_digest, pg_digest, matched, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (timestamp or time.time(), table, chunk_id, oracle_digest, pg_digest,
+                 int(matched), duration)
+            )
+
+    def compact(self, now: Optional[float] = None):
+        """将超过原始保留期的记录汇总到时间桶中，并删除过期的汇总数据。"""
+        now = now or time.time()
+        raw_cutoff = now - self.raw_retention
+        rollups: Dict[Tuple[str, float], Dict[str, float]] = {}
+
+        with self._lock, self._conn:
+            for ts, table, status, oracle_count, pg_count, duration in self._conn.execute(
+                "SELECT ts, table_name, status, oracle_count, pg_count, duration "
+                "FROM table_results WHERE ts < ? ORDER BY ts", (raw_cutoff,)
+            ):
+                rollup = self._get_rollup(rollups, table, ts)
+                rollup['comparisons'] += 1
+                rollup['mismatches'] += int(status == 0)
+                rollup['errors'] += int(status == -1)
+                rollup['total_duration'] += duration
+                rollup['max_duration'] = max(rollup['max_duration'], duration)
+                if status == 1 or (status == 0 and oracle_count == pg_count):
+                    rollup['timed_comparisons'] += 1
+                    rollup['timed_duration'] += duration
+                if oracle_count is not None:
+                    rollup['last_ts'] = ts
+                    rollup['last_oracle_count'] = oracle_count
+                    rollup['last_pg_count'] = pg_count
+
+            for ts, table, matched, duration in self._conn.execute(
+                "SELECT ts, table_name, matched, duration FROM chunk_results WHERE ts < ?",
+                (raw_cutoff,)
+            ):
+                rollup = self._get_rollup(rollups, table, ts)
+                rollup['chunks'] += 1
+                rollup['chunk_mismatches'] += int(not matched)
+                rollup['chunk_duration'] += duration
+
+            for (table, bucket), rollup in rollups.items():
+                self._conn.execute(
+                    "INSERT INTO table_rollups "
+                    "(bucket, table_name, comparisons, mismatches, errors, total_duration, "
+                    "max_duration, timed_comparisons, timed_duration, last_ts, last_oracle_count, "
+                    "last_pg_count, chunks, chunk_mismatches, chunk_duration) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (table_name, bucket) DO UPDATE SET "
+                    "comparisons = comparisons + excluded.comparisons, "
+                    "mismatches = mismatches + excluded.mismatches, "
+                    "errors = errors + excluded.errors, "
+                    "total_duration = total_duration + excluded.total_duration, "
+                    "max_duration = MAX(max_duration, excluded.max_duration), "
+                    "timed_comparisons = timed_comparisons + excluded.timed_comparisons, "
+                    "timed_duration = timed_duration + excluded.timed_duration, "
+                    "last_ts = COALESCE(excluded.last_ts, last_ts), "
+                    "last_oracle_count = COALESCE(excluded.last_oracle_count, last_oracle_count), "
+                    "last_pg_count = COALESCE(excluded.last_pg_count, last_pg_count), "
+                    "chunks = chunks + excluded.chunks, "
+                    "chunk_mismatches = chunk_mismatches + excluded.chunk_mismatches, "
+                    "chunk_duration = chunk_duration + excluded.chunk_duration",
+                    (bucket, table, rollup['comparisons'], rollup['mismatches'],
+                     rollup['errors'], rollup['total_duration'], rollup['max_duration'],
+                     rollup['timed_comparisons'], rollup['timed_duration'],
+                     rollup['last_ts'], rollup['last_oracle_count'], rollup['last_pg_count'],
+                     rollup['chunks'], rollup['chunk_mismatches'], rollup['chunk_duration'])
+                )
+
+            self._conn.execute("DELETE FROM table_results WHERE ts < ?", (raw_cutoff,))
+            self._conn.execute("DELETE FROM chunk_results WHERE ts < ?", (raw_cutoff,))
+            self._conn.execute(
+                "DELETE FROM table_rollups WHERE bucket < ?", (now - self.rollup_retention,)
+            )
+
+        if rollups:
+            logger.info(f"比较历史已汇总 {len(rollups)} 个时间桶")
+
+    def _get_rollup(self,
+                    rollups: Dict[Tuple[str, float], Dict[str, float]],
+                    table: str,
+                    ts: float) -> Dict[str, float]:
+        """获取记录所属时间桶的汇总累加器。"""
+        bucket = ts - ts % self.rollup_interval
+        return rollups.setdefault((table, bucket), {
+            'comparisons': 0, 'mismatches': 0, 'errors': 0,
+            'total_duration': 0.0, 'max_duration': 0.0,
+            'timed_comparisons': 0, 'timed_duration': 0.0,
+            'last_ts': None, 'last_oracle_count': None, 'last_pg_count': None,
+            'chunks': 0, 'chunk_mismatches': 0, 'chunk_duration': 0.0,
+        })
+
+    def get_table_trend(self, table: str, now: Optional[float] = None) -> Dict[str, Optional[float]]:
+        """
+        计算表的趋势指标：
+        - change_rate: 趋势窗口内 Oracle 行数的变化率（行/秒）
+        - replication_lag: 按变化率估算的 PostgreSQL 落后时间（秒）
+        - predicted_duration: 按历史耗时指数加权平均预测的下一轮比较耗时（秒），
+          没有原始记录时使用最近汇总时间桶的平均耗时
+        """
+        now = now or time.time()
+        with self._lock:
+            counts = self._conn.execute(
+                "SELECT ts, oracle_count, pg_count FROM table_results "
+                "WHERE table_name = ? AND ts >= ? AND oracle_count IS NOT NULL "
+                "UNION ALL "
+                "SELECT last_ts, last_oracle_count, last_pg_count FROM table_rollups "
+                "WHERE table_name = ? AND last_ts >= ? AND last_oracle_count IS NOT NULL "
+                "ORDER BY 1",
+                (table, now - self.trend_window, table, now - self.trend_window)
+            ).fetchall()
+            durations = self._conn.execute(
+                f"SELECT duration FROM table_results WHERE table_name = ? AND {_FULL_COMPARISON} "
+                "ORDER BY ts DESC LIMIT 20", (table,)
+            ).fetchall()
+            timed_duration, timed_comparisons = self._conn.execute(
+                "SELECT SUM(timed_duration), SUM(timed_comparisons) FROM ("
+                "SELECT timed_duration, timed_comparisons FROM table_rollups "
+                "WHERE table_name = ? ORDER BY bucket DESC LIMIT ?)",
+                (table, _PREDICTION_BUCKETS)
+            ).fetchone()
+
+        predicted_duration = self._predict_duration([d for (d,) in reversed(durations)])
+        if predicted_duration is None and timed_comparisons:
+            predicted_duration = timed_duration / timed_comparisons
+
+        return {
+            'change_rate': self._change_rate(counts),
+            'replication_lag': self._replication_lag(counts),
+            'predicted_duration': predicted_duration,
+        }
+
+    @staticmethod
+    def _change_rate(counts: List[Tuple[float, int, int]]) -> Optional[float]:
+        """根据首尾两个样本计算行数变化率。"""
+        if len(counts) < 2:
+            return None
+        first_ts, first_count, _ = counts[0]
+        last_ts, last_count, _ = counts[-1]
+        if last_ts <= first_ts:
+            return None
+        return (last_count - first_count) / (last_ts - first_ts)
+
+    def _replication_lag(self, counts: List[Tuple[float, int, int]]) -> Optional[float]:
+        """以行数差除以变化率估算复制延迟。"""
+        if not counts:
+            return None
+        _, oracle_count, pg_count = counts[-1]
+        if pg_count is None:
+            return None
+        difference = oracle_count - pg_count
+        if difference <= 0:
+            return 0.0
+        rate = self._change_rate(counts)
+        if not rate or rate <= 0:
+            return None
+        return difference / rate
+
+    @staticmethod
+    def _predict_duration(durations: List[float], alpha: float = 0.3) -> Optional[float]:
+        """对按时间排序的耗时做指数加权平均。"""
+        if not durations:
+            return None
+        predicted = durations[0]
+        for duration in durations[1:]:
+            predicted = alpha * duration + (1 - alpha) * predicted
+        return predicted
+
+    def close(self):
+        """关闭存储。"""
+        with self._lock:
+            self._conn.close()